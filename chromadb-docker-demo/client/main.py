@@ -7,13 +7,19 @@ resultados de forma heurística.
 from __future__ import annotations
 
 import argparse
+import dbm
+import hashlib
 import os
+import pickle
+import shelve
 import sys
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Iterable, List, Sequence, Set, Tuple
+from typing import AbstractSet, Any, Dict, List, Optional, Sequence, Set, Tuple
 
 import chromadb
 from chromadb.config import Settings
+from chromadb.utils import embedding_functions
 
 DEFAULT_HOST = "localhost"
 DEFAULT_PORT = 8000
@@ -21,6 +27,74 @@ DEFAULT_COLLECTION_NAME = "articulos"
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 ENV_PATH = PROJECT_ROOT / ".env"
+EMBEDDING_CACHE_PATH = Path(__file__).resolve().parent / ".embedding_cache"
+
+# Errores que desactivan la caché de embeddings en disco en lugar de abortar.
+# ``ValueError``/``SyntaxError`` cubren índices corruptos del backend ``dbm.dumb``.
+_EMBEDDING_CACHE_ERRORS = (
+    OSError,
+    EOFError,
+    ValueError,
+    SyntaxError,
+    pickle.UnpicklingError,
+    *dbm.error,
+)
+
+# Documentos de ejemplo almacenados por columnas, listos para ``upsert``.
+_DOC_IDS: Tuple[str, ...] = (
+    "historia-01",
+    "ia-01",
+    "ecologia-01",
+    "deporte-01",
+    "economia-01",
+    "medicina-01",
+    "tecnologia-01",
+    "musica-01",
+    "literatura-01",
+    "ciencia-01",
+)
+_DOC_TEXTS: Tuple[str, ...] = (
+    "La caída del Imperio Romano marcó el inicio de la Edad Media y transformó la política europea.",
+    "Los transformers revolucionaron el NLP al permitir el aprendizaje de dependencias largas en textos.",
+    "La deforestación afecta la biodiversidad y aumenta las emisiones de gases de efecto invernadero.",
+    "El entrenamiento de resistencia mejora la capacidad aeróbica y la salud cardiovascular de los atletas.",
+    "La inflación y la política monetaria están estrechamente relacionadas con las expectativas del mercado.",
+    "Las vacunas de ARNm activan respuestas inmunológicas específicas con tiempos de desarrollo reducidos.",
+    "La computación en la nube facilita la escalabilidad de aplicaciones y la gestión de datos distribuidos.",
+    "El jazz de los años 50 exploró la improvisación modal e influyó en generaciones posteriores de músicos.",
+    "El realismo mágico en América Latina mezcló elementos fantásticos con narrativas cotidianas.",
+    "El método científico combina observación, hipótesis, experimentación y análisis para validar teorías.",
+)
+_DOC_METAS: Tuple[Dict[str, str], ...] = (
+    {"tema": "historia"},
+    {"tema": "ia"},
+    {"tema": "ecologia"},
+    {"tema": "deporte"},
+    {"tema": "economia"},
+    {"tema": "medicina"},
+    {"tema": "tecnologia"},
+    {"tema": "musica"},
+    {"tema": "literatura"},
+    {"tema": "ciencia"},
+)
+
+_QUERIES: Tuple[Dict[str, Any], ...] = (
+    {
+        "text": "¿Cómo reducir el impacto ambiental de una ciudad?",
+        "keywords": frozenset({"ambiental", "deforestación", "emisiones", "biodiversidad"}),
+    },
+    {
+        "text": "¿Qué avances recientes mejoraron el procesamiento del lenguaje natural?",
+        "keywords": frozenset({"nlp", "transformers", "lenguaje", "ia"}),
+    },
+    {
+        "text": "¿Qué factores explican el aumento de los precios?",
+        "keywords": frozenset({"inflación", "precios", "monetaria", "economía"}),
+    },
+)
+
+# Colecciones ya sincronizadas en este proceso.
+_SYNCED_COLLECTIONS: Set[str] = set()
 
 
 def load_env_file(env_path: Path) -> Dict[str, str]:
@@ -30,14 +104,15 @@ def load_env_file(env_path: Path) -> Dict[str, str]:
         return {}
 
     env_values: Dict[str, str] = {}
-    for line in env_path.read_text(encoding="utf-8").splitlines():
-        stripped = line.strip()
-        if not stripped or stripped.startswith("#"):
-            continue
-        if "=" not in stripped:
-            continue
-        key, value = stripped.split("=", 1)
-        env_values[key.strip()] = value.strip()
+    with env_path.open("r", encoding="utf-8") as fh:
+        for line in fh:
+            stripped = line.strip()
+            if not stripped or stripped.startswith("#"):
+                continue
+            key, sep, value = stripped.partition("=")
+            if not sep:
+                continue
+            env_values[key.strip()] = value.strip()
     return env_values
 
 
@@ -57,74 +132,103 @@ def build_client(host: str, port: int) -> chromadb.HttpClient:
     )
 
 
-def ensure_documents(collection: chromadb.api.models.Collection.Collection) -> None:
-    """Inserta documentos de ejemplo de manera idempotente usando ``upsert``."""
-
-    documents: List[Tuple[str, str, Dict[str, str]]] = [
-        (
-            "historia-01",
-            "La caída del Imperio Romano marcó el inicio de la Edad Media y transformó la política europea.",
-            {"tema": "historia"},
-        ),
-        (
-            "ia-01",
-            "Los transformers revolucionaron el NLP al permitir el aprendizaje de dependencias largas en textos.",
-            {"tema": "ia"},
-        ),
-        (
-            "ecologia-01",
-            "La deforestación afecta la biodiversidad y aumenta las emisiones de gases de efecto invernadero.",
-            {"tema": "ecologia"},
-        ),
-        (
-            "deporte-01",
-            "El entrenamiento de resistencia mejora la capacidad aeróbica y la salud cardiovascular de los atletas.",
-            {"tema": "deporte"},
-        ),
-        (
-            "economia-01",
-            "La inflación y la política monetaria están estrechamente relacionadas con las expectativas del mercado.",
-            {"tema": "economia"},
-        ),
-        (
-            "medicina-01",
-            "Las vacunas de ARNm activan respuestas inmunológicas específicas con tiempos de desarrollo reducidos.",
-            {"tema": "medicina"},
-        ),
-        (
-            "tecnologia-01",
-            "La computación en la nube facilita la escalabilidad de aplicaciones y la gestión de datos distribuidos.",
-            {"tema": "tecnologia"},
-        ),
-        (
-            "musica-01",
-            "El jazz de los años 50 exploró la improvisación modal e influyó en generaciones posteriores de músicos.",
-            {"tema": "musica"},
-        ),
-        (
-            "literatura-01",
-            "El realismo mágico en América Latina mezcló elementos fantásticos con narrativas cotidianas.",
-            {"tema": "literatura"},
-        ),
-        (
-            "ciencia-01",
-            "El método científico combina observación, hipótesis, experimentación y análisis para validar teorías.",
-            {"tema": "ciencia"},
-        ),
-    ]
+def ensure_documents(
+    collection: chromadb.api.models.Collection.Collection,
+    force: bool = False,
+) -> int:
+    """Inserta los documentos de ejemplo que falten y devuelve cuántos se enviaron.
 
-    collection.upsert(
-        ids=[doc_id for doc_id, _, _ in documents],
-        documents=[text for _, text, _ in documents],
-        metadatas=[metadata for _, _, metadata in documents],
-    )
+    Con ``force`` se reenvían todos los documentos vía ``upsert`` aunque ya existan.
+    """
+
+    collection_id = str(collection.id)
+    if collection_id in _SYNCED_COLLECTIONS and not force:
+        return 0
+
+    if force:
+        ids, texts, metas = list(_DOC_IDS), list(_DOC_TEXTS), list(_DOC_METAS)
+    else:
+        existing = set(collection.get(ids=list(_DOC_IDS), include=[])["ids"])
+        keep = [i for i, doc_id in enumerate(_DOC_IDS) if doc_id not in existing]
+        ids = [_DOC_IDS[i] for i in keep]
+        texts = [_DOC_TEXTS[i] for i in keep]
+        metas = [_DOC_METAS[i] for i in keep]
+
+    if ids:
+        collection.upsert(ids=ids, documents=texts, metadatas=metas)
+    _SYNCED_COLLECTIONS.add(collection_id)
+    return len(ids)
+
+
+@lru_cache(maxsize=None)
+def get_embedding_function() -> chromadb.api.types.EmbeddingFunction:
+    """Devuelve la función de embeddings compartida por la colección y las consultas.
+
+    Se crea bajo demanda para que importar el módulo no cargue onnxruntime.
+    """
+
+    return embedding_functions.DefaultEmbeddingFunction()
+
+
+def _embedding_model_id() -> str:
+    """Identifica la función de embeddings y la versión de chromadb que la provee."""
+
+    embed_fn = get_embedding_function()
+    name = embed_fn.name() if hasattr(embed_fn, "name") else type(embed_fn).__name__
+    return f"{name}@chromadb-{chromadb.__version__}"
+
+
+def _compute_embeddings(texts: Sequence[str]) -> List[Tuple[float, ...]]:
+    """Calcula los embeddings de las consultas sin pasar por la caché."""
 
+    embed_fn = get_embedding_function()
+    return [tuple(float(value) for value in embedding) for embedding in embed_fn(list(texts))]
 
-def keyword_relevance(text: str, keywords: Iterable[str]) -> int:
-    """Calcula un puntaje de relevancia heurístico basado en palabras clave."""
 
-    text_lower = text.lower()
-    hits = sum(1 for kw in keywords if kw in text_lower)
+@lru_cache(maxsize=256)
+def embed_queries(texts: Tuple[str, ...]) -> Tuple[Tuple[float, ...], ...]:
+    """Obtiene los embeddings de las consultas usando una caché en memoria y en disco.
+
+    Las entradas en disco se indexan por modelo y texto, de modo que un cambio en la
+    función de embeddings no reutiliza vectores antiguos. La caché en disco es
+    opcional: si no se puede abrir, leer o escribir, los embeddings se calculan
+    directamente.
+    """
+
+    model_id = _embedding_model_id()
+    cache_keys = [hashlib.sha256(f"{model_id}:{text}".encode("utf-8")).hexdigest() for text in texts]
+    try:
+        cache = shelve.open(str(EMBEDDING_CACHE_PATH))
+    except _EMBEDDING_CACHE_ERRORS:
+        return tuple(_compute_embeddings(texts))
+
+    with cache:
+        embeddings: List[Optional[Tuple[float, ...]]] = []
+        for cache_key in cache_keys:
+            try:
+                embeddings.append(cache.get(cache_key))
+            except _EMBEDDING_CACHE_ERRORS:
+                embeddings.append(None)
+
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            computed = _compute_embeddings([texts[i] for i in missing])
+            for i, embedding in zip(missing, computed):
+                embeddings[i] = embedding
+                try:
+                    cache[cache_keys[i]] = embedding
+                except _EMBEDDING_CACHE_ERRORS:
+                    pass
+    return tuple(embeddings)
+
+
+def keyword_relevance(text_lower: str, keywords_tuple: Tuple[str, ...]) -> int:
+    """Calcula un puntaje de relevancia heurístico basado en palabras clave.
+
+    ``text_lower`` debe estar ya en minúsculas.
+    """
+
+    hits = sum(map(text_lower.__contains__, keywords_tuple))
     if hits == 0:
         return 0
     if hits == 1:
@@ -137,37 +241,45 @@ def keyword_relevance(text: str, keywords: Iterable[str]) -> int:
 def evaluate_results(
     query: str,
     results: Dict[str, Sequence[Sequence]],
-    keywords: Set[str],
+    keywords: AbstractSet[str],
 ) -> None:
     """Imprime los resultados de la consulta con evaluación heurística."""
 
-    ids = results.get("ids", [[]])[0]
-    documents = results.get("documents", [[]])[0]
-    metadatas = results.get("metadatas", [[]])[0]
+    ids = results["ids"][0]
+    documents = results["documents"][0]
+    metadatas = results["metadatas"][0]
 
-    print("\n==============================")
-    print(f"Consulta: {query}")
-    print("Resultados (top 3):")
+    out: List[str] = [
+        "\n==============================",
+        f"Consulta: {query}",
+        "Resultados (top 3):",
+    ]
+    kw_tuple = tuple(keywords)
+    related_any = False
     for idx, (doc_id, doc_text, metadata) in enumerate(zip(ids, documents, metadatas), start=1):
-        score = keyword_relevance(doc_text, keywords)
+        score = keyword_relevance(doc_text.lower(), kw_tuple)
+        if score:
+            related_any = True
         topic = metadata.get("tema", "desconocido") if isinstance(metadata, dict) else metadata
-        print(f"#{idx} -> ID: {doc_id}")
-        print(f"       Tema: {topic}")
-        print(f"       Texto: {doc_text}")
-        print(f"       Relevancia aparente (0-5): {score}")
+        out.append(f"#{idx} -> ID: {doc_id}")
+        out.append(f"       Tema: {topic}")
+        out.append(f"       Texto: {doc_text}")
+        out.append(f"       Relevancia aparente (0-5): {score}")
 
-    coverage_topics = {md.get("tema") for md in metadatas if isinstance(md, dict)}
-    print(f"Cobertura temática: {', '.join(sorted(t for t in coverage_topics if t)) or 'sin datos'}")
+    coverage_topics = {md["tema"] for md in metadatas if isinstance(md, dict) and "tema" in md}
+    out.append(f"Cobertura temática: {', '.join(sorted(t for t in coverage_topics if t)) or 'sin datos'}")
 
-    related_hits = [doc for doc in documents if any(kw in doc.lower() for kw in keywords)]
-    if related_hits:
-        print("Notas: Los resultados contienen coincidencias claras con las palabras clave.")
+    if related_any:
+        out.append("Notas: Los resultados contienen coincidencias claras con las palabras clave.")
     else:
-        print("Notas: Las coincidencias dependen de la similitud semántica, no hay palabras clave exactas.")
+        out.append("Notas: Las coincidencias dependen de la similitud semántica, no hay palabras clave exactas.")
 
+    sys.stdout.write("\n".join(out) + "\n")
 
-def run(reset: bool) -> None:
-    env_file_values = load_env_file(ENV_PATH)
+
+def run(reset: bool, force_upsert: bool = False) -> None:
+    need_env = not (os.getenv("CHROMA_HOST") and os.getenv("CHROMA_PORT"))
+    env_file_values = load_env_file(ENV_PATH) if need_env else {}
 
     host = resolve_setting("CHROMA_HOST", DEFAULT_HOST, env_file_values)
     port_str = resolve_setting("CHROMA_PORT", str(DEFAULT_PORT), env_file_values)
@@ -183,32 +295,28 @@ def run(reset: bool) -> None:
         print("[cliente] --reset recibido. Limpiando datos remotos...")
         client.reset()
 
-    collection = client.get_or_create_collection(name=DEFAULT_COLLECTION_NAME)
-
-    ensure_documents(collection)
-    print("[cliente] Documentos insertados/actualizados correctamente.")
-
-    queries = [
-        {
-            "text": "¿Cómo reducir el impacto ambiental de una ciudad?",
-            "keywords": {"ambiental", "deforestación", "emisiones", "biodiversidad"},
-        },
-        {
-            "text": "¿Qué avances recientes mejoraron el procesamiento del lenguaje natural?",
-            "keywords": {"nlp", "transformers", "lenguaje", "ia"},
-        },
-        {
-            "text": "¿Qué factores explican el aumento de los precios?",
-            "keywords": {"inflación", "precios", "monetaria", "economía"},
-        },
-    ]
+    collection = client.get_or_create_collection(
+        name=DEFAULT_COLLECTION_NAME,
+        embedding_function=get_embedding_function(),
+    )
 
-    for query_data in queries:
-        response = collection.query(
-            query_texts=[query_data["text"]],
-            n_results=3,
-        )
-        evaluate_results(query_data["text"], response, set(query_data["keywords"]))
+    written = ensure_documents(collection, force=force_upsert)
+    if written:
+        print(f"[cliente] {written} documentos insertados/actualizados correctamente.")
+    else:
+        print("[cliente] La colección ya contiene todos los documentos; se omite el upsert.")
+
+    all_texts = tuple(query_data["text"] for query_data in _QUERIES)
+    query_embeddings = embed_queries(all_texts)
+
+    response = collection.query(
+        query_embeddings=[list(embedding) for embedding in query_embeddings],
+        n_results=3,
+    )
+
+    for i, query_data in enumerate(_QUERIES):
+        sub_response = {key: [response[key][i]] for key in ("ids", "documents", "metadatas")}
+        evaluate_results(query_data["text"], sub_response, query_data["keywords"])
 
     print("\nEvaluación completada. Revisa los resultados anteriores para un análisis heurístico.")
 
@@ -220,13 +328,18 @@ def parse_args(argv: Sequence[str]) -> argparse.Namespace:
         action="store_true",
         help="Limpia la base de datos remota antes de insertar documentos.",
     )
+    parser.add_argument(
+        "--force-upsert",
+        action="store_true",
+        help="Reenvía todos los documentos aunque ya existan en la colección.",
+    )
     return parser.parse_args(argv)
 
 
 if __name__ == "__main__":
     arguments = parse_args(sys.argv[1:])
     try:
-        run(reset=arguments.reset)
+        run(reset=arguments.reset, force_upsert=arguments.force_upsert)
     except Exception as exc:  # noqa: BLE001 - reporte legible
         print(f"Error al ejecutar el cliente: {exc}")
         sys.exit(1)